@@ -8,6 +8,8 @@ from sentence_transformers import CrossEncoder
 ES_HOST = os.getenv("ES_HOST", "localhost")
 ES_PORT = 9200
 INDEX_NAME = "novel_index"
+META_INDEX_NAME = "novel_index_meta"
+CACHE_INDEX_NAME = "novel_query_cache"
 RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
 es = Elasticsearch(f"http://{ES_HOST}:{ES_PORT}")
@@ -52,6 +54,34 @@ def wait_for_es(max_retries=30, delay=2):
     return False
 
 
+def get_index_generation():
+    resp = es.options(ignore_status=404).get(index=META_INDEX_NAME, id="generation")
+    if not resp.get("found"):
+        return 0
+    return resp["_source"]["value"]
+
+
+def bump_index_generation():
+    # 索引内容变化后递增代数，旧代数的缓存条目不再命中
+    es.update(
+        index=META_INDEX_NAME,
+        id="generation",
+        body={
+            "script": {"source": "ctx._source.value += 1"},
+            "upsert": {"value": 1},
+        },
+        refresh=True,
+    )
+    generation = get_index_generation()
+    if es.indices.exists(index=CACHE_INDEX_NAME):
+        es.delete_by_query(
+            index=CACHE_INDEX_NAME,
+            body={"query": {"range": {"generation": {"lt": generation}}}},
+            refresh=True,
+        )
+    return generation
+
+
 def index_novel(filepath):
     if not wait_for_es():
         print("Failed to connect to Elasticsearch.")
@@ -76,9 +106,14 @@ def index_novel(filepath):
     actions = read_and_chunk_file(filepath)
 
     if actions:
-        success, _ = helpers.bulk(es, actions)
-        print(f"Indexed {success} chunks from {filepath}.")
-        es.indices.refresh(index=INDEX_NAME)
+        try:
+            success, _ = helpers.bulk(es, actions)
+            print(f"Indexed {success} chunks from {filepath}.")
+            es.indices.refresh(index=INDEX_NAME)
+        finally:
+            # bulk 部分失败时索引也可能已被修改，同样需要让缓存失效
+            generation = bump_index_generation()
+            print(f"Index generation bumped to {generation}.")
     else:
         print("No content to index.")
 
@@ -151,11 +186,15 @@ def clear_index():
     if not wait_for_es():
         return
 
-    if es.indices.exists(index=INDEX_NAME):
-        es.indices.delete(index=INDEX_NAME)
-        print(f"Index {INDEX_NAME} deleted.")
-    else:
-        print(f"Index {INDEX_NAME} does not exist.")
+    try:
+        if es.indices.exists(index=INDEX_NAME):
+            es.indices.delete(index=INDEX_NAME)
+            print(f"Index {INDEX_NAME} deleted.")
+        else:
+            print(f"Index {INDEX_NAME} does not exist.")
+    finally:
+        generation = bump_index_generation()
+        print(f"Index generation bumped to {generation}, query cache invalidated.")
 
 
 if __name__ == "__main__":
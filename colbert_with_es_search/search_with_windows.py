@@ -3,12 +3,18 @@ import sys
 import argparse
 import time
 import re
+import hashlib
+from datetime import datetime, timedelta, timezone
 from elasticsearch import Elasticsearch, helpers
 from sentence_transformers import CrossEncoder, SentenceTransformer
 
 ES_HOST = os.getenv("ES_HOST", "localhost")
 ES_PORT = 9200
 INDEX_NAME = "novel_index"
+META_INDEX_NAME = "novel_index_meta"
+CACHE_INDEX_NAME = "novel_query_cache"
+CACHE_SIMILARITY_THRESHOLD = float(os.getenv("CACHE_SIMILARITY_THRESHOLD", "0.95"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "86400"))
 RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
 es = Elasticsearch(f"http://{ES_HOST}:{ES_PORT}")
@@ -83,6 +89,148 @@ def wait_for_es(max_retries=30, delay=2):
     return False
 
 
+def get_index_generation():
+    resp = es.options(ignore_status=404).get(index=META_INDEX_NAME, id="generation")
+    if not resp.get("found"):
+        return 0
+    return resp["_source"]["value"]
+
+
+def bump_index_generation():
+    # 索引内容变化后递增代数，旧代数的缓存条目不再命中
+    es.update(
+        index=META_INDEX_NAME,
+        id="generation",
+        body={
+            "script": {"source": "ctx._source.value += 1"},
+            "upsert": {"value": 1},
+        },
+        refresh=True,
+    )
+    generation = get_index_generation()
+    if es.indices.exists(index=CACHE_INDEX_NAME):
+        es.delete_by_query(
+            index=CACHE_INDEX_NAME,
+            body={"query": {"range": {"generation": {"lt": generation}}}},
+            refresh=True,
+        )
+    return generation
+
+
+def ensure_cache_index():
+    if es.indices.exists(index=CACHE_INDEX_NAME):
+        return
+
+    es.indices.create(
+        index=CACHE_INDEX_NAME,
+        body={
+            "settings": {"number_of_shards": 1, "number_of_replicas": 0},
+            "mappings": {
+                "properties": {
+                    "query": {"type": "keyword"},
+                    "embedding": {
+                        "type": "dense_vector",
+                        "dims": bi_reranker.get_sentence_embedding_dimension(),
+                        "index": True,
+                        "similarity": "cosine",
+                    },
+                    "generation": {"type": "long"},
+                    "use_window": {"type": "boolean"},
+                    "top_k_recall": {"type": "integer"},
+                    "top_k_final": {"type": "integer"},
+                    "results": {"type": "object", "enabled": False},
+                    "expires_at": {"type": "date"},
+                }
+            },
+        },
+    )
+
+
+def cache_filter(generation, top_k_recall, top_k_final, use_window):
+    return [
+        {"term": {"generation": generation}},
+        {"term": {"use_window": use_window}},
+        {"term": {"top_k_recall": top_k_recall}},
+        {"term": {"top_k_final": top_k_final}},
+        {"range": {"expires_at": {"gt": "now"}}},
+    ]
+
+
+def lookup_cached_results(embedding, filters, threshold):
+    if not es.indices.exists(index=CACHE_INDEX_NAME):
+        return None
+
+    resp = es.search(
+        index=CACHE_INDEX_NAME,
+        body={
+            "knn": {
+                "field": "embedding",
+                "query_vector": embedding,
+                "k": 1,
+                "num_candidates": 10,
+                "filter": filters,
+                "similarity": threshold,
+            },
+            "_source": ["query", "results"],
+        },
+    )
+
+    hits = resp["hits"]["hits"]
+    if not hits:
+        return None
+
+    # cosine 的 _score = (1 + cos) / 2，还原成余弦相似度便于展示
+    similarity = 2 * hits[0]["_score"] - 1
+    return hits[0]["_source"], similarity
+
+
+def store_cached_results(
+    query, embedding, generation, top_k_recall, top_k_final, use_window, results
+):
+    ensure_cache_index()
+    es.delete_by_query(
+        index=CACHE_INDEX_NAME,
+        body={"query": {"range": {"expires_at": {"lte": "now"}}}},
+    )
+
+    # 同一查询 + 参数使用固定 _id，重复查询覆盖旧条目而不是追加
+    key = f"{query}|{use_window}|{top_k_recall}|{top_k_final}"
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=CACHE_TTL_SECONDS)
+    es.index(
+        index=CACHE_INDEX_NAME,
+        id=hashlib.sha1(key.encode("utf-8")).hexdigest(),
+        document={
+            "query": query,
+            "embedding": embedding,
+            "generation": generation,
+            "use_window": use_window,
+            "top_k_recall": top_k_recall,
+            "top_k_final": top_k_final,
+            "results": results,
+            "expires_at": expires_at.isoformat(),
+        },
+        refresh=True,
+    )
+
+
+def print_results(query, results, use_window):
+    print(f"\n====== Search Results for: '{query}' ======")
+    for i, item in enumerate(results):
+        doc, score = item["doc"], item["score"]
+        # window模式：输出window_content；普通模式：输出content
+        display_content = doc.get("window_content") or doc["content"]
+
+        # 调试：同时显示短content用于对比
+        if use_window and "window_content" in doc:
+            print(f"\n[Rank {i + 1}] Score: {score:.4f} | Novel: {doc['novel']}")
+            print(f"  (short) ...{doc['content']}...")
+            print(f"  (window) ...{display_content}...")
+        else:
+            print(f"\n[Rank {i + 1}] Score: {score:.4f} | Novel: {doc['novel']}")
+            print(f"Content: ...{display_content}...")
+        print("-" * 60)
+
+
 def index_novel(filepath, use_window=False, window_size=2):
     if not wait_for_es():
         print("Failed to connect to Elasticsearch.")
@@ -119,18 +267,45 @@ def index_novel(filepath, use_window=False, window_size=2):
     index_type = "window" if use_window else "chunk"
 
     if actions:
-        success, _ = helpers.bulk(es, actions)
-        print(f"Indexed {success} {index_type}s from {filepath}.")
-        es.indices.refresh(index=INDEX_NAME)
+        try:
+            success, _ = helpers.bulk(es, actions)
+            print(f"Indexed {success} {index_type}s from {filepath}.")
+            es.indices.refresh(index=INDEX_NAME)
+        finally:
+            # bulk 部分失败时索引也可能已被修改，同样需要让缓存失效
+            generation = bump_index_generation()
+            print(f"Index generation bumped to {generation}.")
     else:
         print("No content to index.")
 
 
-def search(query, top_k_recall=50, top_k_final=5, use_window=False):
+def search(
+    query,
+    top_k_recall=50,
+    top_k_final=5,
+    use_window=False,
+    use_cache=True,
+    cache_threshold=CACHE_SIMILARITY_THRESHOLD,
+):
     if not wait_for_es():
         print("Failed to connect to Elasticsearch.")
         return
 
+    # Step 0: 语义缓存 - 相似问法直接返回上次的精排结果
+    if use_cache:
+        generation = get_index_generation()
+        filters = cache_filter(generation, top_k_recall, top_k_final, use_window)
+        embedding = bi_reranker.encode(query, normalize_embeddings=True).tolist()
+        cached = lookup_cached_results(embedding, filters, cache_threshold)
+        if cached:
+            entry, similarity = cached
+            print(
+                f"Cache hit: '{entry['query']}' (similarity {similarity:.4f}, "
+                f"generation {generation})"
+            )
+            print_results(query, entry["results"], use_window)
+            return entry["results"]
+
     source_fields = ["content", "novel", "offset"]
     if use_window:
         source_fields.append("window_content")
@@ -172,20 +347,16 @@ def search(query, top_k_recall=50, top_k_final=5, use_window=False):
     print(f"Reranked hits: {len(ranked_hits)}")
 
     # Step 4: 输出top-k，window模式下用window_content
-    print(f"\n====== Search Results for: '{query}' ======")
-    for i, (doc, score) in enumerate(ranked_hits[:top_k_final]):
-        # window模式：输出window_content；普通模式：输出content
-        display_content = doc.get("window_content") or doc["content"]
-
-        # 调试：同时显示短content用于对比
-        if use_window and "window_content" in doc:
-            print(f"\n[Rank {i + 1}] Score: {score:.4f} | Novel: {doc['novel']}")
-            print(f"  (short) ...{doc['content']}...")
-            print(f"  (window) ...{display_content}...")
-        else:
-            print(f"\n[Rank {i + 1}] Score: {score:.4f} | Novel: {doc['novel']}")
-            print(f"Content: ...{display_content}...")
-        print("-" * 60)
+    results = [
+        {"doc": doc, "score": float(score)} for doc, score in ranked_hits[:top_k_final]
+    ]
+    print_results(query, results, use_window)
+
+    if use_cache:
+        store_cached_results(
+            query, embedding, generation, top_k_recall, top_k_final, use_window, results
+        )
+    return results
 
 
 def list_indexed_novels():
@@ -218,11 +389,15 @@ def clear_index():
     if not wait_for_es():
         return
 
-    if es.indices.exists(index=INDEX_NAME):
-        es.indices.delete(index=INDEX_NAME)
-        print(f"Index {INDEX_NAME} deleted.")
-    else:
-        print(f"Index {INDEX_NAME} does not exist.")
+    try:
+        if es.indices.exists(index=INDEX_NAME):
+            es.indices.delete(index=INDEX_NAME)
+            print(f"Index {INDEX_NAME} deleted.")
+        else:
+            print(f"Index {INDEX_NAME} does not exist.")
+    finally:
+        generation = bump_index_generation()
+        print(f"Index generation bumped to {generation}, query cache invalidated.")
 
 
 if __name__ == "__main__":
@@ -250,6 +425,18 @@ if __name__ == "__main__":
         default=2,
         help="Number of sentences before/after for window context (default: 2)",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the semantic query cache",
+    )
+    parser.add_argument(
+        "--cache-threshold",
+        type=float,
+        default=CACHE_SIMILARITY_THRESHOLD,
+        help="Cosine similarity needed to reuse a cached query "
+        f"(default: {CACHE_SIMILARITY_THRESHOLD})",
+    )
 
     args = parser.parse_args()
 
@@ -272,6 +459,8 @@ if __name__ == "__main__":
                 top_k_recall=args.top_k_recall,
                 top_k_final=args.top_k,
                 use_window=False,
+                use_cache=not args.no_cache,
+                cache_threshold=args.cache_threshold,
             )
     elif args.mode == "search-window":
         if not args.query:
@@ -282,6 +471,8 @@ if __name__ == "__main__":
                 top_k_recall=args.top_k_recall,
                 top_k_final=args.top_k,
                 use_window=True,
+                use_cache=not args.no_cache,
+                cache_threshold=args.cache_threshold,
             )
     elif args.mode == "list":
         list_indexed_novels()